@@ -1,103 +1,259 @@
 import streamlit as st
 import fitz
+import hashlib
 import io
+import math
+import os
+import time
 from PIL import Image
 import pandas as pd
+import pyarrow as pa
 import cohere
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 # from tempfile import NamedTemporaryFile
 
 st.set_page_config(page_title="PDF Content Extractor", layout="wide")
 
-def extract_text_from_pdf(pdf_file):
-    """Extract text from PDF using PyMuPDF."""
-    text = ""
-    try:
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            text += page.get_text()
-        return text
-    except Exception as e:
-        st.error(f"Error extracting text: {e}")
-        return None
+@st.cache_resource(max_entries=4)
+def open_pdf(digest: str, _pdf_bytes: bytes) -> fitz.Document:
+    """Open and parse a PDF once; reused across all extractors and reruns.
 
-def extract_images_from_pdf(pdf_file):
-    """Extract images from PDF using PyMuPDF."""
-    images = []
-    try:
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            image_list = page.get_images(full=True)
-            
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                base_image = pdf_document.extract_image(xref)
-                image_bytes = base_image["image"]
-                
-                # Convert to PIL Image
-                image = Image.open(io.BytesIO(image_bytes))
-                images.append((f"Page {page_num+1}, Image {img_index+1}", image))
-                
-        return images
-    except Exception as e:
-        st.error(f"Error extracting images: {e}")
-        return []
+    Keyed on the upload's SHA-256 digest; the leading underscore tells
+    Streamlit not to hash the raw bytes on every lookup.
+    """
+    return fitz.open(stream=_pdf_bytes, filetype="pdf")
 
-def extract_tables_from_pdf_pymupdf(pdf_file):
-    """Extract tables from PDF using PyMuPDF's built-in table detection."""
+def coerce_numeric_columns(df):
+    """Convert columns of numeric-looking strings to real number dtypes.
+
+    Currency symbols, thousands separators, and percent signs are
+    stripped before coercion; a column is converted only when every
+    non-empty cell parses as a number.
+    """
+    # Iterate positionally so duplicate column names stay addressable
+    for i in range(df.shape[1]):
+        series = df.iloc[:, i]
+        # Covers both classic object columns and pandas 3's str dtype
+        if not pd.api.types.is_string_dtype(series):
+            continue
+        cleaned = series.str.replace(r"[$€£%,\s]", "", regex=True)
+        coerced = pd.to_numeric(cleaned, errors="coerce")
+        non_empty = cleaned.notna() & (cleaned != "")
+        if non_empty.any() and coerced[non_empty].notna().all():
+            df.isetitem(i, coerced)
+    return df
+
+THUMBNAIL_SIZE = (512, 512)
+IMAGES_PER_PAGE = 12
+
+def make_thumbnail(image_bytes):
+    """Downscale an image to JPEG thumbnail bytes for display."""
+    thumb = Image.open(io.BytesIO(image_bytes))
+    thumb.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+    if thumb.mode not in ("RGB", "L"):
+        thumb = thumb.convert("RGB")
+    buf = io.BytesIO()
+    thumb.save(buf, format="JPEG", quality=80)
+    return buf.getvalue()
+
+def extract_all(pdf_document):
+    """Extract text, images, and tables in a single pass over the pages."""
+    text_parts = []
+    images = []
     tables = []
     try:
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            
+        for page in pdf_document:
+            page_num = page.number
+
+            # Accumulate per-page text and join once: linear instead of
+            # quadratic in total text size
+            text_parts.append(page.get_text())
+
+            # Record references only; decoding happens lazily per
+            # visible page in the Images tab
+            for img_index, img in enumerate(page.get_images(full=True)):
+                images.append((page_num + 1, img_index + 1, img[0]))
+
             # Extract tables using PyMuPDF's built-in table detection
             tabs = page.find_tables()
             for i, table in enumerate(tabs.tables):
-                # Convert PyMuPDF table to pandas DataFrame
-                rows_data = []
-                for row in range(table.rows):
-                    row_data = []
-                    for col in range(table.cols):
-                        row_data.append(table.cell(row, col).text)
-                    rows_data.append(row_data)
-                
+                # Pull the whole table in one C-level pass instead of
+                # rows*cols individual cell() calls
+                rows_data = table.extract()
+
                 # Create column names (either first row or generic)
                 if len(rows_data) > 0:
-                    if all(cell and cell.strip() for cell in rows_data[0]):
+                    # map + unbound str.strip dispatches at C level,
+                    # cheaper than a genexpr on wide tables; extract()
+                    # yields None for empty cells, so guard first
+                    first = rows_data[0]
+                    if None not in first and all(map(bool, map(str.strip, first))):
                         # Use first row as header if it contains values
-                        columns = rows_data[0]
-                        df = pd.DataFrame(rows_data[1:], columns=columns)
+                        columns = first
+                        data_rows = rows_data[1:]
                     else:
                         # Create generic column names
                         columns = [f"Column {i+1}" for i in range(len(rows_data[0]))]
-                        df = pd.DataFrame(rows_data, columns=columns)
-                    
+                        data_rows = rows_data
+
+                    # Build the columnar layout in Arrow's C++ core, then
+                    # hand it to pandas; positional arrays (not dicts)
+                    # keep duplicate header names intact
+                    if data_rows:
+                        arrays = [pa.array(col) for col in zip(*data_rows)]
+                        df = pa.table(arrays, names=columns).to_pandas(zero_copy_only=False)
+                    else:
+                        df = pd.DataFrame(columns=columns)
+
+                    df = coerce_numeric_columns(df)
                     tables.append({
                         "page": page_num + 1,
                         "table_number": i + 1,
                         "dataframe": df
                     })
-        
-        return tables
+
+            # Drop per-page object references so MuPDF resources aren't
+            # retained across iterations (see PyMuPDF leak reports)
+            tabs = None
+            page = None
+
+        return {"text": "".join(text_parts), "images": images, "tables": tables}
+    except Exception as e:
+        st.error(f"Error extracting PDF content: {e}")
+        return {"text": "", "images": [], "tables": []}
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_image_batch(digest: str, xrefs: tuple, _pdf_bytes: bytes):
+    """Decode a batch of xrefs, encoding thumbnails on a thread pool.
+
+    extract_image stays on the calling thread because PyMuPDF documents
+    are not thread-safe; PIL releases the GIL inside its codecs, so the
+    thumbnail work parallelizes across cores. Returns one
+    (thumb_bytes, image_bytes, ext) per xref, deduplicating repeats;
+    entries that fail to decode are reported and returned as None.
+    """
+    pdf_document = open_pdf(digest, _pdf_bytes)
+    raw = {}
+    for xref in dict.fromkeys(xrefs):
+        try:
+            raw[xref] = pdf_document.extract_image(xref)
+        except Exception as e:
+            st.error(f"Error extracting image (xref {xref}): {e}")
+
+    # Worker threads have no Streamlit context, so capture thumbnail
+    # failures and report them after the pool drains
+    def _thumb(xref):
+        try:
+            return make_thumbnail(raw[xref]["image"])
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        thumbs = list(executor.map(_thumb, raw))
+
+    loaded = {}
+    for xref, thumb in zip(raw, thumbs):
+        if isinstance(thumb, Exception):
+            st.error(f"Error decoding image (xref {xref}): {thumb}")
+            continue
+        loaded[xref] = (thumb, raw[xref]["image"], raw[xref]["ext"])
+    return [loaded.get(xref) for xref in xrefs]
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def get_all(digest: str, _pdf_bytes: bytes):
+    """Memoized single-pass extraction keyed on the upload's digest."""
+    try:
+        pdf_document = open_pdf(digest, _pdf_bytes)
     except Exception as e:
-        st.error(f"Error extracting tables with PyMuPDF: {e}")
-        return []
+        st.error(f"Error opening PDF: {e}")
+        return {"text": "", "images": [], "tables": []}
+    results = extract_all(pdf_document)
+    fitz.TOOLS.store_shrink(100)
+    return results
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def get_summary_text(digest: str, _pdf_bytes: bytes):
+    """Extract plain text for summarization with a reduced MuPDF flag set.
+
+    The Summary tab never shows this text, so ligature expansion and
+    image handling are skipped; the Text tab keeps the default flags.
+    """
+    try:
+        parts = []
+        for page in open_pdf(digest, _pdf_bytes):
+            parts.append(page.get_text("text", flags=fitz.TEXT_PRESERVE_WHITESPACE))
+            page = None
+        return "".join(parts)
+    except Exception as e:
+        st.error(f"Error extracting text: {e}")
+        return ""
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def text_to_bytes(text: str) -> bytes:
+    """Encode download text to UTF-8 once; reruns reuse the cached bytes."""
+    return text.encode("utf-8")
+
+@st.cache_data(show_spinner=False)
+def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """Serialize a table to CSV bytes once; reruns reuse the cached copy."""
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding="utf-8")
+    return buf.getvalue()
+
+SUMMARY_CHUNK_CHARS = 3000
+SUMMARY_MIN_CHARS = 250  # co.summarize rejects shorter inputs
+
+def _split_into_chunks(text, chunk_chars=SUMMARY_CHUNK_CHARS):
+    """Split text into ~chunk_chars pieces, preferring sentence boundaries."""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            cut = text.rfind(". ", start, end)
+            if cut > start:
+                end = cut + 1
+        chunks.append(text[start:end])
+        start = end
+    # A short tail would be rejected by the API; fold it into the
+    # previous chunk instead of dispatching it separately
+    if len(chunks) > 1 and len(chunks[-1]) < SUMMARY_MIN_CHARS:
+        chunks[-2] += chunks[-1]
+        chunks.pop()
+    return chunks
+
+def _summarize_with_retry(co, text, attempts=3):
+    """Summarize one chunk, retrying with exponential backoff."""
+    for attempt in range(attempts):
+        try:
+            response = co.summarize(
+                text=text,
+                length='medium',
+                format='paragraph',
+                model='command',
+                additional_command='Make it comprehensive and highlight key points'
+            )
+            return response.summary
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(2 ** attempt)
 
 def get_cohere_summary(text, api_key):
-    """Get summary of the text using Cohere API."""
+    """Get summary of the text using Cohere API.
+
+    Long documents are split into sentence-aligned chunks summarized in
+    parallel, then a final pass summarizes the partial summaries.
+    """
     try:
         co = cohere.Client(api_key)
-        response = co.summarize(
-            text=text,
-            length='medium',
-            format='paragraph',
-            model='command',
-            additional_command='Make it comprehensive and highlight key points'
-        )
-        return response.summary
+        chunks = _split_into_chunks(text)
+        if len(chunks) == 1:
+            return _summarize_with_retry(co, chunks[0])
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            partials = list(executor.map(lambda chunk: _summarize_with_retry(co, chunk), chunks))
+        return _summarize_with_retry(co, "\n".join(partials))
     except Exception as e:
         st.error(f"Error with Cohere API: {e}")
         return None
@@ -115,44 +271,71 @@ def main():
     if uploaded_file is not None:
         file_details = {"Filename": uploaded_file.name, "FileType": uploaded_file.type, "FileSize": f"{uploaded_file.size / 1024:.2f} KB"}
         st.write(file_details)
-        
+
+        # Parse the PDF once; extraction results are cached per upload.
+        # Hash the bytes once up front so cache lookups compare a short
+        # digest instead of re-hashing the whole file every rerun.
+        pdf_bytes = uploaded_file.getvalue()
+        digest = hashlib.sha256(pdf_bytes).hexdigest()
+
+        # Drop MuPDF's cached objects for the previous document when a
+        # new file is uploaded, keeping resident memory bounded
+        if st.session_state.get("pdf_file_id") != uploaded_file.file_id:
+            fitz.TOOLS.store_shrink(100)
+            st.session_state["pdf_file_id"] = uploaded_file.file_id
+
+        # One fused traversal feeds every tab
+        results = get_all(digest, pdf_bytes)
+
         # Create tabs for different extraction types
         tab1, tab2, tab3, tab4 = st.tabs(["Text", "Images", "Tables", "Summary"])
-        
+
         with tab1:
             st.header("Extracted Text")
-            text = extract_text_from_pdf(uploaded_file)
+            text = results["text"]
             if text:
                 st.text_area("Text Content", text, height=400)
-                st.download_button("Download Text", text, file_name=f"{uploaded_file.name}_text.txt")
+                st.download_button("Download Text", text_to_bytes(text), file_name=f"{uploaded_file.name}_text.txt", mime="text/plain")
         
         with tab2:
             st.header("Extracted Images")
-            uploaded_file.seek(0)  # Reset file pointer
-            images = extract_images_from_pdf(uploaded_file)
+            images = results["images"]
             if images:
+                # Only the visible page of images is decoded per rerun
+                num_img_pages = math.ceil(len(images) / IMAGES_PER_PAGE)
+                img_page = 1
+                if num_img_pages > 1:
+                    img_page = st.number_input("Image page", min_value=1, max_value=num_img_pages, value=1)
+                start = (img_page - 1) * IMAGES_PER_PAGE
+                visible = images[start:start + IMAGES_PER_PAGE]
+
+                loaded = load_image_batch(digest, tuple(ref[2] for ref in visible), pdf_bytes)
+
                 cols = st.columns(3)
-                for i, (img_name, img) in enumerate(images):
-                    col = cols[i % 3]
+                shown = 0
+                for (page_num, img_index, xref), entry in zip(visible, loaded):
+                    if entry is None:
+                        continue  # decode failure already reported
+                    thumb_bytes, image_bytes, ext = entry
+                    img_name = f"Page {page_num}, Image {img_index}"
+                    col = cols[shown % 3]
+                    shown += 1
                     with col:
-                        st.image(img, caption=img_name, use_column_width=True)
-                        
+                        st.image(thumb_bytes, caption=img_name, use_column_width=True)
+
                         # Create download link for each image
-                        buf = io.BytesIO()
-                        img.save(buf, format="PNG")
                         btn = st.download_button(
                             label=f"Download {img_name}",
-                            data=buf.getvalue(),
-                            file_name=f"{uploaded_file.name}_{img_name}.png",
-                            mime="image/png"
+                            data=image_bytes,
+                            file_name=f"{uploaded_file.name}_{img_name}.{ext}",
+                            mime=f"image/{ext}"
                         )
             else:
                 st.info("No images found in the PDF.")
         
         with tab3:
             st.header("Extracted Tables")
-            uploaded_file.seek(0)  # Reset file pointer
-            tables = extract_tables_from_pdf_pymupdf(uploaded_file)
+            tables = results["tables"]
             if tables and len(tables) > 0:
                 for table_info in tables:
                     page_num = table_info["page"]
@@ -163,7 +346,7 @@ def main():
                     st.dataframe(df)
                     
                     # Download option for each table
-                    csv = df.to_csv(index=False).encode('utf-8')
+                    csv = df_to_csv_bytes(df)
                     st.download_button(
                         label=f"Download Table {table_num} from Page {page_num} as CSV",
                         data=csv,
@@ -177,14 +360,13 @@ def main():
         with tab4:
             st.header("Document Summary")
             if cohere_api_key:
-                uploaded_file.seek(0)  # Reset file pointer
-                text = extract_text_from_pdf(uploaded_file)
+                text = get_summary_text(digest, pdf_bytes)
                 if text:
                     with st.spinner("Generating summary with Cohere..."):
                         summary = get_cohere_summary(text, cohere_api_key)
                         if summary:
                             st.write(summary)
-                            st.download_button("Download Summary", summary, file_name=f"{uploaded_file.name}_summary.txt")
+                            st.download_button("Download Summary", text_to_bytes(summary), file_name=f"{uploaded_file.name}_summary.txt", mime="text/plain")
             else:
                 st.info("Enter a Cohere API key in the sidebar to generate a summary.")
 